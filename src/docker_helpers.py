@@ -1,6 +1,24 @@
 import re
+from functools import lru_cache
 from .config import CACHE_REGISTRY
 
+# 预编译的正则表达式，避免批量处理时重复解析
+PULL_COMMAND_PATTERN = re.compile(r"^(docker\s+pull\s+)([\w./:-]+)$", re.IGNORECASE)
+FROM_COMMAND_PATTERN = re.compile(
+    r"^\s*(FROM\s+(?:--platform=[\w/]+\s+)?)([\w./:-]+)(\s*AS\s+[\w-]+)?\s*$",
+    re.IGNORECASE
+)
+PULL_IMAGE_PATTERN = re.compile(r"docker\s+pull\s+([\w./:-]+)", re.IGNORECASE)
+FROM_IMAGE_PATTERN = re.compile(r"FROM\s+(?:--platform=[\w/]+\s+)?([\w./:-]+)", re.IGNORECASE)
+# 匹配 'FROM <image_name>'，同时处理 AS 和 --platform；确保不匹配以 ARG 开头的行
+DOCKERFILE_FROM_PATTERN = re.compile(r"^\s*FROM\s+(?:--platform=[\w/]+\s+)?([\w./:-]+)", re.IGNORECASE | re.MULTILINE)
+# 捕获 FROM 行的各个部分，用于替换镜像名
+DOCKERFILE_FROM_REPLACE_PATTERN = re.compile(
+    r"^(FROM\s+(?:--platform=[\w/]+\s+)?)([\w./:-]+)((?:\s+AS\s+[\w-]+)?)$",
+    re.IGNORECASE | re.MULTILINE
+)
+
+@lru_cache(maxsize=4096)
 def transform_image_name(image_name):
     """
     将 Docker 镜像名转换为使用私有仓库的地址。
@@ -28,7 +46,7 @@ def accelerate_command(command):
     支持 'docker pull <镜像>' 和 'FROM <镜像>' 指令。
     """
     # 匹配 'docker pull' 命令
-    pull_match = re.search(r"^(docker\s+pull\s+)([\w./:-]+)$", command.strip(), re.IGNORECASE)
+    pull_match = PULL_COMMAND_PATTERN.search(command.strip())
     if pull_match:
         prefix = pull_match.group(1)
         image_name = pull_match.group(2)
@@ -36,11 +54,7 @@ def accelerate_command(command):
         return f"{prefix}{new_image_name}"
 
     # 匹配 Dockerfile 的 'FROM' 指令
-    from_match = re.search(
-        r"^\s*(FROM\s+(?:--platform=[\w/]+\s+)?)([\w./:-]+)(\s*AS\s+[\w-]+)?\s*$",
-        command,
-        re.IGNORECASE
-    )
+    from_match = FROM_COMMAND_PATTERN.search(command)
     if from_match:
         prefix = from_match.group(1)
         image_name = from_match.group(2)
@@ -55,11 +69,11 @@ def get_image_name_from_input(command):
     original_command = command.strip()
     
     # 尝试从 'docker pull' 或 'FROM' 中提取镜像名
-    pull_match = re.search(r"docker\s+pull\s+([\w./:-]+)", original_command, re.IGNORECASE)
+    pull_match = PULL_IMAGE_PATTERN.search(original_command)
     if pull_match:
         return pull_match.group(1)
     
-    from_match = re.search(r"FROM\s+(?:--platform=[\w/]+\s+)?([\w./:-]+)", original_command, re.IGNORECASE)
+    from_match = FROM_IMAGE_PATTERN.search(original_command)
     if from_match:
         return from_match.group(1)
         
@@ -71,11 +85,7 @@ def parse_dockerfile(content):
     解析 Dockerfile 内容，提取所有 FROM 指令中的基础镜像。
     会忽略 ARG 定义的变量。
     """
-    # 正则表达式匹配 'FROM <image_name>'，同时处理 AS 和 --platform
-    # 确保不匹配以 ARG 开头的行
-    from_pattern = re.compile(r"^\s*FROM\s+(?:--platform=[\w/]+\s+)?([\w./:-]+)", re.IGNORECASE | re.MULTILINE)
-    
-    images = from_pattern.findall(content)
+    images = DOCKERFILE_FROM_PATTERN.findall(content)
     
     # 去重并返回
     return list(dict.fromkeys(images))
@@ -94,10 +104,56 @@ def accelerate_dockerfile_content(content):
         accelerated_image, _ = transform_image_name(image_name)
         return f"{prefix}{accelerated_image}{suffix}"
 
-    # This regex captures the parts of the FROM line more robustly
-    from_pattern = re.compile(
-        r"^(FROM\s+(?:--platform=[\w/]+\s+)?)([\w./:-]+)((?:\s+AS\s+[\w-]+)?)$", 
-        re.IGNORECASE | re.MULTILINE
-    )
-    
-    return from_pattern.sub(replace_from, content)
\ No newline at end of file
+    return DOCKERFILE_FROM_REPLACE_PATTERN.sub(replace_from, content)
+
+def split_image_tag(image_tag):
+    """
+    将 'name:tag' 拆分为 (name, tag)，未指定标签时使用 'latest'。
+    能正确处理带端口的仓库地址 (如 'host:5000/app')。
+    """
+    name, sep, tag = image_tag.rpartition(':')
+    if not sep or '/' in tag:
+        return image_tag, "latest"
+    return name, tag
+
+def plan_build_matrix(image_tags, targets=None, platforms=None):
+    """
+    根据镜像标签、构建目标 (--target) 和平台 (--platform) 生成构建矩阵。
+
+    返回分组列表，每个构建目标一组:
+    - 'target':   构建目标 (None 表示 Dockerfile 的最终阶段)
+    - 'images':   该目标最终要发布的镜像名列表 (不含仓库地址)
+    - 'cells':    矩阵单元列表，每个单元为 {'platform', 'tags', 'repository'}，可独立构建和推送
+    - 'manifest': 是否需要在所有单元完成后合并为多平台清单
+
+    有多个目标时，镜像名追加 '-<目标>' 后缀 (如 'app:1.0' -> 'app-api:1.0')。
+    有多个平台时，单元不打标签 ('tags' 为空)，只按摘要推送到 'repository'，
+    最后由各单元的摘要合并为多平台清单，仓库中不会留下临时标签。
+    """
+    targets = list(targets) if targets else [None]
+    platforms = list(platforms) if platforms else [None]
+
+    groups = []
+    for target in targets:
+        images = []
+        for image_tag in image_tags:
+            name, tag = split_image_tag(image_tag)
+            if target and len(targets) > 1:
+                name = f"{name}-{target}"
+            images.append(f"{name}:{tag}")
+
+        repository = split_image_tag(images[0])[0]
+        cells = []
+        for platform in platforms:
+            if len(platforms) > 1:
+                cells.append({'platform': platform, 'tags': [], 'repository': repository})
+            else:
+                cells.append({'platform': platform, 'tags': images, 'repository': repository})
+
+        groups.append({
+            'target': target,
+            'images': images,
+            'cells': cells,
+            'manifest': len(platforms) > 1,
+        })
+    return groups
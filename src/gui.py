@@ -9,8 +9,9 @@ import tempfile
 import configparser
 
 from .config import PRIVATE_REGISTRY, CACHE_REGISTRY
-from .docker_helpers import transform_image_name, accelerate_command, get_image_name_from_input, parse_dockerfile, accelerate_dockerfile_content
+from .docker_helpers import transform_image_name, accelerate_command, get_image_name_from_input, parse_dockerfile, accelerate_dockerfile_content, plan_build_matrix
 from .ssh_manager import SSHManager
+from .transfer_tuning import format_rate, format_eta
 
 class App(ThemedTk):
     STATE_FILE = "build_state.ini"
@@ -19,7 +20,7 @@ class App(ThemedTk):
         super().__init__(theme="arc")
 
         self.title("Docker 加速与远程构建工具")
-        self.geometry("750x750")
+        self.geometry("750x850")
 
         # --- 样式 ---
         style = ttk.Style(self)
@@ -93,8 +94,19 @@ class App(ThemedTk):
         self.image_tag_entry.grid(row=1, column=1, columnspan=2, sticky="ew", pady=5)
         # self.image_tag_entry.insert(0, "your-app-name:latest") # Replaced by _load_state
 
+        # 构建矩阵 (可选，多个值用逗号分隔)
+        ttk.Label(frame, text="构建目标:").grid(row=2, column=0, padx=(0, 5), sticky="w")
+        self.targets_var = tk.StringVar()
+        ttk.Entry(frame, textvariable=self.targets_var).grid(row=2, column=1, columnspan=2, sticky="ew")
+
+        ttk.Label(frame, text="目标平台:").grid(row=3, column=0, padx=(0, 5), sticky="w")
+        self.platforms_var = tk.StringVar()
+        ttk.Entry(frame, textvariable=self.platforms_var).grid(row=3, column=1, columnspan=2, sticky="ew", pady=5)
+
+        ttk.Label(frame, text="多个标签/目标/平台用逗号分隔，例如 api,worker 或 linux/amd64,linux/arm64").grid(row=4, column=0, columnspan=3, sticky="w")
+
         self.build_button = ttk.Button(frame, text="开始构建并推送", command=self.start_build_and_push_thread)
-        self.build_button.grid(row=2, column=1, columnspan=2, sticky="e", pady=(10, 0))
+        self.build_button.grid(row=5, column=1, columnspan=2, sticky="e", pady=(10, 0))
 
     def _create_dockerfile_widgets(self):
         """创建 Dockerfile 批量预热的组件"""
@@ -118,9 +130,11 @@ class App(ThemedTk):
         self.progress_var = tk.DoubleVar()
         self.progress_bar = ttk.Progressbar(frame, variable=self.progress_var, maximum=100)
         self.progress_bar.grid(row=1, column=0, sticky="ew", pady=5)
+        self.progress_text_var = tk.StringVar()
+        ttk.Label(frame, textvariable=self.progress_text_var).grid(row=2, column=0, sticky="w")
         
         button_frame = ttk.Frame(frame)
-        button_frame.grid(row=2, column=0, sticky="e", pady=5)
+        button_frame.grid(row=3, column=0, sticky="e", pady=5)
 
     def _load_state(self):
         """加载上次的构建状态"""
@@ -130,6 +144,8 @@ class App(ThemedTk):
                 config.read(self.STATE_FILE, encoding='utf-8')
                 last_tag = config.get('Build', 'last_image_tag', fallback='your-app-name:latest')
                 self.image_tag_var.set(last_tag)
+                self.targets_var.set(config.get('Build', 'last_targets', fallback=''))
+                self.platforms_var.set(config.get('Build', 'last_platforms', fallback=''))
             else:
                 self.image_tag_var.set("your-app-name:latest")
         except Exception as e:
@@ -140,7 +156,11 @@ class App(ThemedTk):
         """保存当前的构建状态"""
         try:
             config = configparser.ConfigParser()
-            config['Build'] = {'last_image_tag': self.image_tag_var.get()}
+            config['Build'] = {
+                'last_image_tag': self.image_tag_var.get(),
+                'last_targets': self.targets_var.get(),
+                'last_platforms': self.platforms_var.get(),
+            }
             with open(self.STATE_FILE, 'w', encoding='utf-8') as configfile:
                 config.write(configfile)
         except Exception as e:
@@ -159,11 +179,15 @@ class App(ThemedTk):
         self.log_text.config(state="disabled")
         self.update_idletasks()
 
-    def update_progress(self, sent, total):
-        """更新进度条的回调函数"""
+    def update_progress(self, sent, total, rate=None, eta=None):
+        """更新进度条及吞吐量/剩余时间显示的回调函数"""
         if total > 0:
             progress = (sent / total) * 100
             self.progress_var.set(progress)
+            text = f"{progress:.1f}%  ({sent / 1024 / 1024:.1f} / {total / 1024 / 1024:.1f} MB)"
+            if rate is not None:
+                text += f"  {format_rate(rate)}  剩余 {format_eta(eta)}"
+            self.progress_text_var.set(text)
         self.update_idletasks()
 
     def convert(self, event=None):
@@ -189,6 +213,8 @@ class App(ThemedTk):
         self.log_text.config(state="normal")
         self.log_text.delete(1.0, tk.END)
         self.log_text.config(state="disabled")
+        self.progress_var.set(0)
+        self.progress_text_var.set("")
         
         import threading
         thread = threading.Thread(target=target_func, args=args, daemon=True)
@@ -223,11 +249,18 @@ class App(ThemedTk):
         except Exception as e:
             self.log(f"读取或解析 Dockerfile 时出错: {e}")
 
+    @staticmethod
+    def _split_list(value):
+        """将逗号分隔的输入拆分为去除空白的非空项列表。"""
+        return [item.strip() for item in value.split(',') if item.strip()]
+
     def start_build_and_push_thread(self):
         project_dir = self.project_dir_var.get()
-        image_tag = self.image_tag_var.get()
+        image_tags = self._split_list(self.image_tag_var.get())
+        targets = self._split_list(self.targets_var.get())
+        platforms = self._split_list(self.platforms_var.get())
 
-        if not project_dir or not image_tag:
+        if not project_dir or not image_tags:
             self.log("错误: 请先选择项目目录并指定镜像标签。")
             return
         
@@ -235,14 +268,16 @@ class App(ThemedTk):
             self.log(f"错误: 在 '{project_dir}' 中未找到 Dockerfile。")
             return
 
-        self._start_thread(self.build_and_push, project_dir, image_tag)
+        self._start_thread(self.build_and_push, project_dir, image_tags, targets, platforms)
 
-    def build_and_push(self, project_dir, image_tag):
+    def build_and_push(self, project_dir, image_tags, targets=None, platforms=None):
         """
         执行远程构建和推送的完整流程。
         """
+        groups = plan_build_matrix(image_tags, targets, platforms)
         self.log(f"--- 开始远程构建项目: {project_dir} ---")
-        self.log(f"--- 目标镜像: {PRIVATE_REGISTRY}/{image_tag} ---")
+        for group in groups:
+            self.log(f"--- 目标镜像: {', '.join(f'{PRIVATE_REGISTRY}/{image}' for image in group['images'])} ---")
         manager = SSHManager(logger_func=self.log)
 
         try:
@@ -250,16 +285,19 @@ class App(ThemedTk):
                 self.log("错误: 无法连接到远程服务器。")
                 return
 
-            success = manager.build_and_push_project(project_dir, image_tag)
+            success = manager.build_and_push_project(
+                project_dir, image_tags, progress_callback=self.update_progress,
+                targets=targets, platforms=platforms
+            )
 
             if success:
                 self.log("\n--- 远程构建并推送流程成功完成！ ---")
                 self._save_state() # 保存状态
-                full_image_tag = f"{PRIVATE_REGISTRY}/{image_tag}"
-                pull_command = f"docker pull {full_image_tag}"
+                pull_commands = [f"docker pull {PRIVATE_REGISTRY}/{group['images'][0]}" for group in groups]
                 self.log(f"镜像已推送到私有仓库。您现在可以在本地使用以下命令拉取：")
-                self.log(f"--> {pull_command}")
-                self.output_var.set(pull_command)
+                for pull_command in pull_commands:
+                    self.log(f"--> {pull_command}")
+                self.output_var.set(pull_commands[0])
             else:
                 self.log("\n--- 远程构建并推送流程失败。请检查以上日志。 ---")
 
@@ -0,0 +1,372 @@
+"""
+本地命令/Dockerfile 批量转换服务。
+
+让多个 CI 任务共享一个常驻进程来转换 `docker pull` 命令和 Dockerfile，
+避免每次都重新启动 Python。用法:
+
+    python -m src.rewrite_service --port 8765 --workers 8
+
+接口:
+    POST /v1/commands      JSON {"commands": [...]} 或纯文本 (每行一条)，返回转换结果列表
+    POST /v1/dockerfile    Dockerfile 内容 (支持分块传输)，按行流式转换后返回
+    POST /v1/dockerfiles   tar 包，返回其中 Dockerfile 的 FROM 均已转换的 tar 包 (其他文件原样保留)
+    GET  /metrics          请求延迟、吞吐量及镜像名缓存命中情况
+    GET  /healthz          健康检查
+"""
+import argparse
+import fnmatch
+import io
+import json
+import posixpath
+import socket
+import tarfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from .docker_helpers import accelerate_command, accelerate_dockerfile_content, transform_image_name
+
+# 单个请求体的最大字节数 (tar 包需整体读入内存)
+MAX_BODY_SIZE = 64 * 1024 * 1024
+# tar 包解压后的总大小上限，防止小压缩包展开后耗尽内存
+MAX_TAR_EXTRACTED_SIZE = 256 * 1024 * 1024
+# 流式读取 Dockerfile 的块大小
+STREAM_CHUNK_SIZE = 64 * 1024
+# 套接字读写超时 (秒)，避免连接后迟迟不发送请求的客户端长期占用工作线程
+CONNECTION_TIMEOUT = 10
+# tar 包中需要转换的文件名模式，其余文件原样保留
+DOCKERFILE_PATTERNS = ("Dockerfile*", "*.Dockerfile")
+
+
+class LengthRequiredError(ValueError):
+    """POST 请求既没有 Content-Length 也不是分块传输。"""
+
+
+class ServiceMetrics:
+    """线程安全地统计各接口的请求数、处理条目数和延迟。"""
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.window = window
+        self.endpoints = {}
+
+    def record(self, endpoint, latency, items, ok=True):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                'requests': 0, 'errors': 0, 'items': 0,
+                'latency_total': 0.0, 'latencies': deque(maxlen=self.window),
+            })
+            stats['requests'] += 1
+            stats['items'] += items
+            stats['latency_total'] += latency
+            stats['latencies'].append(latency)
+            if not ok:
+                stats['errors'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            uptime = time.monotonic() - self.started
+            endpoints = {}
+            for endpoint, stats in self.endpoints.items():
+                recent = sorted(stats['latencies'])
+                endpoints[endpoint] = {
+                    'requests': stats['requests'],
+                    'errors': stats['errors'],
+                    'items': stats['items'],
+                    'requests_per_sec': round(stats['requests'] / uptime, 3),
+                    'items_per_sec': round(stats['items'] / uptime, 3),
+                    'latency_ms': {
+                        'avg': round(stats['latency_total'] / stats['requests'] * 1000, 3),
+                        'p50': round(_percentile(recent, 0.50) * 1000, 3),
+                        'p95': round(_percentile(recent, 0.95) * 1000, 3),
+                        'p99': round(_percentile(recent, 0.99) * 1000, 3),
+                        'max': round(recent[-1] * 1000, 3),
+                    },
+                }
+        cache = transform_image_name.cache_info()
+        return {
+            'uptime_sec': round(uptime, 3),
+            'endpoints': endpoints,
+            'image_cache': {
+                'hits': cache.hits, 'misses': cache.misses,
+                'size': cache.currsize, 'maxsize': cache.maxsize,
+            },
+        }
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def is_dockerfile(path):
+    name = posixpath.basename(path)
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in DOCKERFILE_PATTERNS)
+
+
+def rewrite_dockerfile_tar(data):
+    """
+    转换 tar 包中的 Dockerfile，其他成员原样保留。
+    返回新的 tar 包字节及转换的文件数；解压后总大小超过 MAX_TAR_EXTRACTED_SIZE 时抛出 ValueError。
+    """
+    output = io.BytesIO()
+    count = 0
+    extracted = 0
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as src, \
+            tarfile.open(fileobj=output, mode="w") as dst:
+        for member in src:
+            # 成员头也计入，避免大量空成员绕过限制
+            extracted += member.size + tarfile.BLOCKSIZE
+            if extracted > MAX_TAR_EXTRACTED_SIZE:
+                raise ValueError(f"tar 包解压后过大 (上限 {MAX_TAR_EXTRACTED_SIZE} 字节)")
+            if not member.isfile():
+                dst.addfile(member)
+                continue
+            if not is_dockerfile(member.name):
+                dst.addfile(member, src.extractfile(member))
+                continue
+            content = src.extractfile(member).read().decode('utf-8')
+            rewritten = accelerate_dockerfile_content(content).encode('utf-8')
+            member.size = len(rewritten)
+            dst.addfile(member, io.BytesIO(rewritten))
+            count += 1
+    return output.getvalue(), count
+
+
+class RewriteRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "DockerRewrite/1.0"
+    # 由 StreamRequestHandler.setup 应用到套接字上
+    timeout = CONNECTION_TIMEOUT
+
+    def end_headers(self):
+        # 每个响应后都关闭连接: 线程池按连接分配工作线程，
+        # 若保持 keep-alive，空闲的连接池客户端会占满所有工作线程
+        self.send_header('Connection', 'close')
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        # 访问日志会拖慢高频请求，指标请通过 /metrics 查看
+        pass
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            self._send_json({'status': 'ok'})
+        elif self.path == "/metrics":
+            self._send_json(self.server.metrics.snapshot())
+        else:
+            self._send_error(404, f"未知路径: {self.path}")
+
+    def do_POST(self):
+        handlers = {
+            "/v1/commands": self._handle_commands,
+            "/v1/dockerfile": self._handle_dockerfile,
+            "/v1/dockerfiles": self._handle_dockerfiles,
+        }
+        self.streaming = False
+        handler = handlers.get(self.path)
+        if handler is None:
+            self._send_error(404, f"未知路径: {self.path}")
+            return
+
+        start = time.monotonic()
+        items = 0
+        ok = False
+        try:
+            items = handler()
+            ok = True
+        except LengthRequiredError as e:
+            self._send_error(411, str(e))
+        except ValueError as e:
+            self._send_error(400, str(e))
+        except Exception as e:
+            self._send_error(500, f"处理请求时出错: {e}")
+        finally:
+            self.server.metrics.record(self.path, time.monotonic() - start, items, ok)
+
+    def _body_chunks(self):
+        """
+        校验请求头并返回逐块产出请求体的迭代器，支持 Content-Length 和分块传输编码。
+        请求头不合法时立即抛出异常，因此可以在发送响应头之前调用。
+        """
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            return self._iter_chunked_body()
+        length = self.headers.get('Content-Length')
+        if length is None:
+            raise LengthRequiredError("请求需要 Content-Length 或 Transfer-Encoding: chunked")
+        try:
+            length = int(length)
+        except ValueError:
+            raise ValueError(f"无效的 Content-Length: {length}")
+        if length < 0 or length > MAX_BODY_SIZE:
+            raise ValueError(f"请求体过大 (上限 {MAX_BODY_SIZE} 字节)")
+        return self._iter_sized_body(length)
+
+    def _iter_sized_body(self, remaining):
+        while remaining > 0:
+            chunk = self.rfile.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError("请求体不完整")
+            remaining -= len(chunk)
+            yield chunk
+
+    def _iter_chunked_body(self):
+        total = 0
+        while True:
+            line = self.rfile.readline(1024)
+            try:
+                size = int(line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise ValueError(f"无效的分块长度: {line!r}")
+            if size == 0:
+                # 跳过可能存在的尾部头字段，直到空行
+                while self.rfile.readline(1024) not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            total += size
+            if total > MAX_BODY_SIZE:
+                raise ValueError(f"请求体过大 (上限 {MAX_BODY_SIZE} 字节)")
+            yield from self._iter_sized_body(size)
+            self.rfile.readline(1024)  # 分块末尾的 CRLF
+
+    def _read_body(self):
+        return b"".join(self._body_chunks())
+
+    def _handle_commands(self):
+        body = self._read_body()
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                commands = json.loads(body)['commands']
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                raise ValueError(f"请求体应为 {{\"commands\": [...]}}: {e}")
+            if not isinstance(commands, list):
+                raise ValueError("'commands' 必须是列表")
+            if not all(isinstance(command, str) for command in commands):
+                raise ValueError("'commands' 中的每一项都必须是字符串")
+        else:
+            commands = body.decode('utf-8').splitlines()
+        results = [accelerate_command(command) for command in commands]
+        self._send_json({'results': results})
+        return len(results)
+
+    def _handle_dockerfile(self):
+        """边读边转换，使用分块编码返回，无需缓存整个 Dockerfile。"""
+        chunks = self._body_chunks()
+        self.streaming = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        lines = 0
+        pending = b""
+        for chunk in chunks:
+            pending += chunk
+            # 只处理完整的行，最后一行留到下一块
+            complete, sep, pending = pending.rpartition(b"\n")
+            if sep:
+                lines += self._write_rewritten_lines(complete + sep)
+        if pending:
+            lines += self._write_rewritten_lines(pending)
+        self.wfile.write(b"0\r\n\r\n")
+        return lines
+
+    def _write_rewritten_lines(self, data):
+        text = data.decode('utf-8')
+        rewritten = accelerate_dockerfile_content(text).encode('utf-8')
+        self.wfile.write(f"{len(rewritten):x}\r\n".encode('ascii') + rewritten + b"\r\n")
+        return text.count("\n") or 1
+
+    def _handle_dockerfiles(self):
+        try:
+            data, count = rewrite_dockerfile_tar(self._read_body())
+        except tarfile.TarError as e:
+            raise ValueError(f"无效的 tar 包: {e}")
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-tar')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return count
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self.close_connection = True
+        # 流式响应已开始时无法再返回错误状态，只能中断连接
+        if not getattr(self, 'streaming', False):
+            self._send_json({'error': message}, status)
+
+
+class RewriteServer(HTTPServer):
+    """
+    用固定大小的线程池处理连接的 HTTP 服务器。
+    每个响应后都会关闭连接，因此工作线程只在处理单个请求期间被占用；
+    关闭服务器时会主动断开仍在处理中的连接，不等待它们结束。
+    """
+
+    def __init__(self, address, workers=8):
+        super().__init__(address, RewriteRequestHandler)
+        self.metrics = ServiceMetrics()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rewrite")
+        self.active_lock = threading.Lock()
+        self.active_requests = set()
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        with self.active_lock:
+            self.active_requests.add(request)
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.active_lock:
+                self.active_requests.discard(request)
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self.active_lock:
+            requests = list(self.active_requests)
+        for request in requests:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Docker 命令/Dockerfile 批量转换服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址 (默认: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口 (默认: 8765)")
+    parser.add_argument("--workers", type=int, default=8, help="工作线程数 (默认: 8)")
+    args = parser.parse_args(argv)
+
+    server = RewriteServer((args.host, args.port), workers=args.workers)
+    print(f"--> 转换服务已启动: http://{args.host}:{args.port} (工作线程: {args.workers})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("--> 转换服务已停止。")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,13 +7,42 @@ from .config import (
     SSH_HOST, SSH_PORT, SSH_USER, SSH_KEY_PATH, SSH_KEY_PASS,
     PRIVATE_REGISTRY, REGISTRY_USER, REGISTRY_PASS
 )
+from .transfer_tuning import TransferProfile, TransferMeter, DOWNLOAD, UPLOAD, MAX_WINDOW_SIZE
+from .docker_helpers import plan_build_matrix
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
 import posixpath
+import shlex
+import threading
+import time
+
+# 连接时吞吐量探测的持续时间 (秒) 及数据量上限
+PROBE_DURATION = 1.5
+PROBE_MAX_SIZE = 256 * 1024 * 1024
+
+# 远程 buildx 构建器名称及矩阵构建的最大并发数
+BUILDX_BUILDER = "wdsds-builder"
+MAX_PARALLEL_BUILDS = 8
+# 清理时删除构建器中超过此时长未使用的缓存，保留近期缓存供后续构建复用
+BUILDX_CACHE_MAX_AGE = "168h"
+
+def _cell_label(target, cell):
+    """生成矩阵单元在日志中的标识，如 'api/linux/arm64'。"""
+    return "/".join(part for part in (target, cell['platform']) if part) or "default"
 
 class SSHManager:
     def __init__(self, logger_func=print):
         self.ssh = None
         self.sftp = None
-        self.logger = logger_func
+        self._logger_func = logger_func
+        # 矩阵构建会从多个线程同时写日志，GUI 的日志函数不是原子的，需串行调用
+        self._log_lock = threading.Lock()
+        self.profile = TransferProfile.load(SSH_HOST, SSH_PORT)
+
+    def logger(self, message):
+        """线程安全地写一条日志。"""
+        with self._log_lock:
+            self._logger_func(message)
 
     def connect(self):
         """建立 SSH 连接。"""
@@ -37,12 +66,81 @@ class SSHManager:
                 self.logger("--> SSH 压缩已启用。")
 
             self.logger("--> SSH 连接成功！")
+            self._tune_transport()
             return True
         except Exception as e:
             self.logger(f"SSH 连接失败: {e}")
             return False
 
-    def execute_command(self, command):
+    def _measure_rtt(self, samples=3):
+        """通过 keepalive 全局请求测量链路往返时间，取最小值以排除抖动。"""
+        transport = self.ssh.get_transport()
+        best = None
+        for _ in range(samples):
+            start = time.monotonic()
+            transport.global_request("keepalive@openssh.com", wait=True)
+            elapsed = time.monotonic() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def _measure_throughput(self, duration=PROBE_DURATION, max_size=PROBE_MAX_SIZE):
+        """
+        从远程读取随机数据来估算下行吞吐量 (随机数据不受压缩影响)。
+        探测按时间而不是按字节数结束: 从收到第一个字节起持续读取 duration 秒，
+        使高 RTT 链路也能走出 TCP 慢启动，测得的是链路带宽而不是 RTT 的函数。
+        探测通道使用最大窗口，避免结果被默认窗口限制。
+        """
+        transport = self.ssh.get_transport()
+        channel = transport.open_session(window_size=MAX_WINDOW_SIZE)
+        try:
+            channel.settimeout(15)
+            channel.exec_command(f"head -c {max_size} /dev/urandom")
+            # 从收到第一个字节开始计时，排除命令启动的开销
+            channel.recv(65536)
+            start = time.monotonic()
+            counted = 0
+            while time.monotonic() - start < duration:
+                data = channel.recv(65536)
+                if not data:
+                    break
+                counted += len(data)
+            return counted, time.monotonic() - start
+        finally:
+            # 提前关闭通道，远程 head 随之退出
+            channel.close()
+
+    def _tune_transport(self):
+        """
+        测量 RTT 与下行吞吐量，按带宽时延积调整本端接收窗口和包大小，并用调优后的参数打开 SFTP。
+        这些参数只决定服务器向本端发送数据的速度，即只对下载有效。
+        已保存的参数足够新时跳过吞吐量探测；测量或打开 SFTP 失败都不影响连接本身。
+        """
+        try:
+            self.profile.record_rtt(self._measure_rtt())
+            if self.profile.is_fresh():
+                self.logger("--> 使用最近保存的吞吐量，跳过探测。")
+            else:
+                self.profile.record_throughput(*self._measure_throughput(), DOWNLOAD)
+        except Exception as e:
+            self.logger(f"--> 链路测量失败，使用已保存的传输参数: {e}")
+
+        transport = self.ssh.get_transport()
+        transport.default_window_size = self.profile.window_size
+        transport.default_max_packet_size = self.profile.max_packet_size
+        try:
+            self.sftp = paramiko.SFTPClient.from_transport(
+                transport,
+                window_size=self.profile.window_size,
+                max_packet_size=self.profile.max_packet_size
+            )
+        except Exception as e:
+            # 留到首次传输时再用默认参数打开
+            self.logger(f"--> 无法以调优参数打开 SFTP，将在传输时使用默认参数: {e}")
+            self.sftp = None
+        self.profile.save()
+        self.logger(f"--> 传输参数: {self.profile.describe()}")
+
+    def execute_command(self, command, log_prefix=""):
         """在远程服务器上执行命令并记录输出，返回命令的退出状态码。"""
         if not self.ssh:
             self.logger("错误: SSH 未连接。")
@@ -54,12 +152,12 @@ class SSHManager:
             
             # 实时读取标准输出
             for line in iter(stdout.readline, ""):
-                self.logger(line.strip())
+                self.logger(f"{log_prefix}{line.strip()}")
             
             # 检查错误输出
             error_output = stderr.read().decode('utf-8').strip()
             if error_output:
-                 self.logger(f"远程错误: {error_output}")
+                 self.logger(f"{log_prefix}远程错误: {error_output}")
 
             # 获取命令退出状态码
             exit_status = stdout.channel.recv_exit_status()
@@ -82,10 +180,12 @@ class SSHManager:
             
             remote_file = self.sftp.open(remote_path, 'rb')
             file_size = self.sftp.stat(remote_path).st_size
-            
-            # 设置更大的块大小以提高速度
-            chunk_size = 2 * 1024 * 1024  # 2MB
+            # 预读: 按学习到的并发数同时发出多个读请求，掩盖链路延迟
+            remote_file.prefetch(file_size, max_concurrent_requests=self.profile.max_requests)
+
+            chunk_size = self.profile.chunk_size(DOWNLOAD)
             bytes_sent = 0
+            meter = TransferMeter(file_size)
 
             with open(local_path, 'wb') as local_file:
                 while True:
@@ -94,10 +194,12 @@ class SSHManager:
                         break
                     local_file.write(data)
                     bytes_sent += len(data)
+                    rate, eta = meter.update(bytes_sent)
                     if progress_callback:
-                        progress_callback(bytes_sent, file_size)
+                        progress_callback(bytes_sent, file_size, rate, eta)
             
             remote_file.close()
+            self._record_transfer(bytes_sent, meter.elapsed, DOWNLOAD)
             self.logger("--> SFTP 下载完成。")
             return True
         except Exception as e:
@@ -116,28 +218,43 @@ class SSHManager:
                 self.sftp = self.ssh.open_sftp()
 
             file_size = os.path.getsize(local_path)
-            
-            # 设置更大的块大小以提高速度
-            chunk_size = 2 * 1024 * 1024  # 2MB
+
+            # 上传不受本端窗口参数影响，分块大小按上行吞吐量估计
+            chunk_size = self.profile.chunk_size(UPLOAD)
             bytes_sent = 0
+            meter = TransferMeter(file_size)
 
             with open(local_path, 'rb') as local_file:
                 with self.sftp.open(remote_path, 'wb') as remote_file:
+                    # 流水线写入: 不等待每个写请求的确认即发送下一个
+                    remote_file.set_pipelined(True)
                     while True:
                         data = local_file.read(chunk_size)
                         if not data:
                             break
                         remote_file.write(data)
                         bytes_sent += len(data)
+                        rate, eta = meter.update(bytes_sent)
                         if progress_callback:
-                            progress_callback(bytes_sent, file_size)
+                            progress_callback(bytes_sent, file_size, rate, eta)
 
+            self._record_transfer(bytes_sent, meter.elapsed, UPLOAD)
             self.logger("--> SFTP 文件上传完成。")
             return True
         except Exception as e:
             self.logger(f"SFTP 文件上传失败: {e}")
             return False
 
+    def _record_transfer(self, num_bytes, elapsed, direction):
+        """用本次传输的实测吞吐量及传输后的 RTT 样本更新并保存该主机的传输参数。"""
+        self.profile.record_throughput(num_bytes, elapsed, direction)
+        try:
+            self.profile.record_rtt(self._measure_rtt(samples=1))
+        except Exception as e:
+            self.logger(f"--> RTT 测量失败: {e}")
+        self.profile.save()
+        self.logger(f"--> 已更新传输参数: {self.profile.describe()}")
+
     def close(self):
         """关闭 SFTP 和 SSH 连接。"""
         if self.sftp:
@@ -148,9 +265,14 @@ class SSHManager:
             self.ssh = None
         self.logger("--> SSH 连接已关闭。")
 
-    def build_and_push_project(self, local_project_path, image_tag):
+    def build_and_push_project(self, local_project_path, image_tags, progress_callback=None,
+                               targets=None, platforms=None):
         """
         打包本地项目，上传到远程服务器，构建 Docker 镜像，然后推送到私有仓库。
+        image_tags 为镜像标签列表 (单个标签也需放在列表中)。
+        progress_callback 会在上传过程中以 (已发送, 总大小, 速率, 剩余秒数) 调用。
+        指定 targets / platforms 或多个标签时，上下文只上传一次，
+        并在远程用 buildx 并发构建整个矩阵，见 _build_matrix。
         """
         build_id = str(uuid.uuid4())[:8]
         remote_project_dir = f"/tmp/build-{build_id}"
@@ -168,7 +290,7 @@ class SSHManager:
             return False
 
         # 2. 上传项目压缩包
-        if not self.upload_file(local_tar_path, remote_tar_path):
+        if not self.upload_file(local_tar_path, remote_tar_path, progress_callback):
             self.logger("--> 上传失败，终止构建。")
             os.remove(local_tar_path) # 清理本地临时文件
             return False
@@ -214,30 +336,160 @@ class SSHManager:
                 self.execute_command(f"rm -rf {remote_project_dir} {remote_tar_path}") # 清理
                 return False
 
-        # 6. 远程构建
-        full_image_tag = f"{PRIVATE_REGISTRY}/{image_tag}"
+        # 6. 远程构建并推送
         project_folder_name = os.path.basename(local_project_path.rstrip('/\\'))
         build_context_path = posixpath.join(remote_project_dir, project_folder_name)
         self.logger(f"--> [诊断] 本地项目文件夹名: {project_folder_name}")
         self.logger(f"--> [诊断] 远程构建上下文路径: {build_context_path}")
-        build_command = f"docker build -t {full_image_tag} {build_context_path}"
-        if self.execute_command(build_command) != 0:
-            self.logger("--> 远程 Docker 构建失败，终止构建。")
-            self.execute_command(f"rm -rf {remote_project_dir} {remote_tar_path}") # 清理
-            return False
 
-        # 6. 远程推送
-        if self.execute_command(f"docker push {full_image_tag}") != 0:
-            self.logger("--> 远程 Docker 推送失败。")
-            # 即使推送失败，也继续清理
+        use_matrix = bool(targets or platforms or len(image_tags) > 1)
+        if use_matrix:
+            success = self._build_matrix(remote_project_dir, build_context_path, image_tags, targets, platforms)
+            local_images = []
         else:
-            self.logger(f"--> 镜像 '{full_image_tag}' 已成功推送！")
+            full_image_tag = f"{PRIVATE_REGISTRY}/{image_tags[0]}"
+            build_command = f"docker build -t {full_image_tag} {build_context_path}"
+            if self.execute_command(build_command) != 0:
+                self.logger("--> 远程 Docker 构建失败，终止构建。")
+                self.execute_command(f"rm -rf {remote_project_dir} {remote_tar_path}") # 清理
+                return False
+
+            if self.execute_command(f"docker push {full_image_tag}") != 0:
+                self.logger("--> 远程 Docker 推送失败。")
+                # 即使推送失败，也继续清理
+            else:
+                self.logger(f"--> 镜像 '{full_image_tag}' 已成功推送！")
+            success = True
+            local_images = [full_image_tag]
 
         # 7. 远程清理
         self.logger("--> 开始远程清理...")
-        self.execute_command(f"docker rmi {full_image_tag}")
+        for image in local_images:
+            self.execute_command(f"docker rmi {image}")
+        if use_matrix:
+            # buildx 推送的镜像不会留在本地，需清理的是构建器缓存
+            self.execute_command(
+                f"docker buildx prune --builder {BUILDX_BUILDER} --force --filter until={BUILDX_CACHE_MAX_AGE}"
+            )
         self.execute_command(f"docker logout {PRIVATE_REGISTRY}")
         self.execute_command(f"rm -rf {remote_project_dir} {remote_tar_path}")
         self.logger("--> 远程清理完成。")
 
-        return True
\ No newline at end of file
+        return success
+
+    def _ensure_buildx_builder(self):
+        """确保远程存在支持多平台构建和直接推送的 buildx 构建器 (docker-container 驱动)。"""
+        command = (
+            f"docker buildx inspect {BUILDX_BUILDER} >/dev/null 2>&1 || "
+            f"docker buildx create --name {BUILDX_BUILDER} --driver docker-container"
+        )
+        if self.execute_command(command) != 0:
+            return False
+        return self.execute_command(f"docker buildx inspect --bootstrap {BUILDX_BUILDER} >/dev/null") == 0
+
+    def _capture_command(self, command):
+        """在远程执行命令并返回其标准输出 (不写入日志)，失败时返回 None。"""
+        try:
+            stdin, stdout, stderr = self.ssh.exec_command(command, timeout=60)
+            output = stdout.read().decode('utf-8')
+            return output if stdout.channel.recv_exit_status() == 0 else None
+        except Exception as e:
+            self.logger(f"执行命令时出错: {e}")
+            return None
+
+    def _build_cell(self, work_dir, build_context_path, target, cell, index):
+        """
+        构建并推送矩阵中的一个单元，返回命令退出状态码。
+        没有标签的单元 (多平台构建) 按摘要推送，摘要记录到 cell['digest'] 供合并清单使用。
+        """
+        label = _cell_label(target, cell)
+        command = f"docker buildx build --builder {BUILDX_BUILDER} --progress=plain"
+        if target:
+            command += f" --target {shlex.quote(target)}"
+        if cell['platform']:
+            command += f" --platform {shlex.quote(cell['platform'])}"
+        if cell['tags']:
+            command += " --push"
+            for tag in cell['tags']:
+                command += f" -t {shlex.quote(f'{PRIVATE_REGISTRY}/{tag}')}"
+        else:
+            output = (
+                f"type=image,name={PRIVATE_REGISTRY}/{cell['repository']},"
+                "push-by-digest=true,name-canonical=true,push=true"
+            )
+            metadata_file = posixpath.join(work_dir, f"metadata-{index}.json")
+            command += f" --output {shlex.quote(output)} --metadata-file {shlex.quote(metadata_file)}"
+        command += f" {shlex.quote(build_context_path)} 2>&1"
+
+        exit_status = self.execute_command(command, log_prefix=f"[{label}] ")
+        if exit_status == 0 and not cell['tags']:
+            metadata = self._capture_command(f"cat {shlex.quote(metadata_file)}")
+            try:
+                cell['digest'] = json.loads(metadata)['containerimage.digest']
+            except (TypeError, ValueError, KeyError) as e:
+                self.logger(f"[{label}] 无法读取镜像摘要: {e}")
+                return -1
+        return exit_status
+
+    def _create_manifest(self, group):
+        """将一个构建目标的各平台镜像 (按摘要) 合并为多平台清单，并打上所有最终标签。"""
+        command = "docker buildx imagetools create"
+        for image in group['images']:
+            command += f" -t {shlex.quote(f'{PRIVATE_REGISTRY}/{image}')}"
+        for cell in group['cells']:
+            source = f"{PRIVATE_REGISTRY}/{cell['repository']}@{cell['digest']}"
+            command += f" {shlex.quote(source)}"
+        return self.execute_command(command)
+
+    def _build_matrix(self, work_dir, build_context_path, image_tags, targets, platforms):
+        """
+        在同一个构建上下文上并发构建 目标 x 平台 矩阵。
+        所有单元共用一个 buildx 构建器，因此共享的中间阶段只会构建一次；
+        每个单元完成后立即推送，某个目标的全部平台完成后立即合并多平台清单。
+        """
+        groups = plan_build_matrix(image_tags, targets, platforms)
+        if not self._ensure_buildx_builder():
+            self.logger("--> 无法创建 buildx 构建器，终止构建。")
+            self.logger("--> 提示: 跨架构构建 (如在 amd64 上构建 arm64) 需要先在 VPS 上安装 QEMU:")
+            self.logger("    docker run --privileged --rm tonistiigi/binfmt --install all")
+            return False
+
+        jobs = [(group, cell) for group in groups for cell in group['cells']]
+        remaining = {id(group): len(group['cells']) for group in groups}
+        failed_groups = set()
+        statuses = []
+        self.logger(f"--> 开始并发构建 {len(jobs)} 个矩阵单元...")
+
+        with ThreadPoolExecutor(max_workers=min(len(jobs), MAX_PARALLEL_BUILDS)) as executor:
+            futures = {
+                executor.submit(self._build_cell, work_dir, build_context_path, group['target'], cell, index): (group, cell)
+                for index, (group, cell) in enumerate(jobs)
+            }
+            for future in as_completed(futures):
+                group, cell = futures[future]
+                try:
+                    exit_status = future.result()
+                except Exception as e:
+                    self.logger(f"构建单元时出错: {e}")
+                    exit_status = -1
+                ok = exit_status == 0
+                label = _cell_label(group['target'], cell)
+                statuses.append((label, "成功" if ok else "失败"))
+                self.logger(f"--> 单元 [{label}] {'构建并推送成功' if ok else '构建失败'}。")
+
+                if not ok:
+                    failed_groups.add(id(group))
+                remaining[id(group)] -= 1
+                if remaining[id(group)] == 0 and group['manifest'] and id(group) not in failed_groups:
+                    manifest_label = f"{group['target'] or 'default'} 清单"
+                    if self._create_manifest(group) != 0:
+                        failed_groups.add(id(group))
+                        statuses.append((manifest_label, "失败"))
+                    else:
+                        statuses.append((manifest_label, "成功"))
+                        self.logger(f"--> 多平台镜像 {', '.join(group['images'])} 已推送！")
+
+        self.logger("--> 构建矩阵结果:")
+        for label, status in statuses:
+            self.logger(f"    {label}: {status}")
+        return not failed_groups
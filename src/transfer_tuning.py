@@ -0,0 +1,222 @@
+import configparser
+import os
+import time
+
+# 学习到的传输参数保存文件 (按主机分节)
+PROFILE_FILE = "transfer_profile.ini"
+
+# paramiko 的默认值: 窗口 2MB, 最大包 32KB; SFTP 单个请求最多 32KB
+DEFAULT_WINDOW_SIZE = 2 * 1024 * 1024
+DEFAULT_MAX_PACKET_SIZE = 32 * 1024
+SFTP_REQUEST_SIZE = 32 * 1024
+
+MAX_WINDOW_SIZE = 64 * 1024 * 1024
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+MIN_REQUESTS = 16
+MAX_REQUESTS = 512
+
+# 没有任何测量数据时的初始假设
+DEFAULT_RTT = 0.1  # 秒
+DEFAULT_BANDWIDTH = 1 * 1024 * 1024  # 字节/秒
+
+# 新测量值在滑动平均中的权重
+SMOOTHING = 0.5
+
+# 保存的参数在此时间 (秒) 内视为新鲜，连接时跳过吞吐量探测
+PROFILE_MAX_AGE = 24 * 3600
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+DOWNLOAD = 'download'
+UPLOAD = 'upload'
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def _align(value, unit):
+    return max(unit, int(value) // unit * unit)
+
+
+def _smooth(old, new):
+    return new if old is None else old * (1 - SMOOTHING) + new * SMOOTHING
+
+
+class TransferProfile:
+    """
+    记录某台主机的链路 RTT 与上/下行吞吐量，并据此推导 SSH/SFTP 传输参数。
+    测量结果以滑动平均方式累积，并持久化到 PROFILE_FILE 中。
+
+    上下行分开估计，因为家庭宽带到 VPS 的链路通常是不对称的。
+    注意: 通道窗口、包大小和预读并发数只是本端的接收参数，仅对下载有效；
+    上传速度受服务器端窗口限制，本端只能通过流水线写入和分块大小来优化。
+    """
+
+    def __init__(self, host, port, rtt=None, download_bandwidth=None, upload_bandwidth=None, updated=None):
+        self.host = host
+        self.port = port
+        self.rtt = rtt
+        self.bandwidth = {DOWNLOAD: download_bandwidth, UPLOAD: upload_bandwidth}
+        self.updated = updated
+
+    @property
+    def section(self):
+        return f"{self.host}:{self.port}"
+
+    @classmethod
+    def load(cls, host, port):
+        """从 PROFILE_FILE 加载该主机上次学习到的参数，不存在则返回空白配置。"""
+        profile = cls(host, port)
+        try:
+            if os.path.exists(PROFILE_FILE):
+                config = configparser.ConfigParser()
+                config.read(PROFILE_FILE, encoding='utf-8')
+                if config.has_section(profile.section):
+                    section = profile.section
+                    profile.rtt = config.getfloat(section, 'rtt', fallback=None)
+                    profile.bandwidth[DOWNLOAD] = config.getfloat(section, 'download_bandwidth', fallback=None)
+                    profile.bandwidth[UPLOAD] = config.getfloat(section, 'upload_bandwidth', fallback=None)
+                    updated = config.get(section, 'updated', fallback=None)
+                    if updated:
+                        profile.updated = time.mktime(time.strptime(updated, TIMESTAMP_FORMAT))
+        except Exception as e:
+            print(f"无法加载传输参数: {e}")
+        return profile
+
+    def save(self):
+        """将当前测量值与推导出的参数写回 PROFILE_FILE (保留其他主机的记录)。"""
+        try:
+            config = configparser.ConfigParser()
+            if os.path.exists(PROFILE_FILE):
+                config.read(PROFILE_FILE, encoding='utf-8')
+            section = {
+                'rtt': f"{self.effective_rtt:.4f}",
+                'window_size': str(self.window_size),
+                'max_packet_size': str(self.max_packet_size),
+                'download_chunk_size': str(self.chunk_size(DOWNLOAD)),
+                'upload_chunk_size': str(self.chunk_size(UPLOAD)),
+                'max_requests': str(self.max_requests),
+            }
+            # 只保存实测过的吞吐量，避免把默认值当作测量结果读回
+            for direction, bandwidth in self.bandwidth.items():
+                if bandwidth is not None:
+                    section[f"{direction}_bandwidth"] = f"{bandwidth:.0f}"
+            if self.updated is not None:
+                section['updated'] = time.strftime(TIMESTAMP_FORMAT, time.localtime(self.updated))
+            config[self.section] = section
+            with open(PROFILE_FILE, 'w', encoding='utf-8') as configfile:
+                config.write(configfile)
+        except Exception as e:
+            print(f"无法保存传输参数: {e}")
+
+    def is_fresh(self, max_age=PROFILE_MAX_AGE):
+        """下行吞吐量是否在 max_age 秒内测得 (updated 记录的是最近一次下行测量的时间)。"""
+        return (
+            self.bandwidth[DOWNLOAD] is not None
+            and self.updated is not None
+            and time.time() - self.updated < max_age
+        )
+
+    def record_rtt(self, rtt):
+        if rtt > 0:
+            self.rtt = _smooth(self.rtt, rtt)
+
+    def record_throughput(self, num_bytes, elapsed, direction=DOWNLOAD):
+        """记录一次传输的吞吐量。过小的样本受 RTT 影响太大，直接忽略。"""
+        if elapsed <= 0 or num_bytes < MIN_CHUNK_SIZE:
+            return
+        self.bandwidth[direction] = _smooth(self.bandwidth[direction], num_bytes / elapsed)
+        if direction == DOWNLOAD:
+            self.updated = time.time()
+
+    @property
+    def effective_rtt(self):
+        return self.rtt if self.rtt is not None else DEFAULT_RTT
+
+    def effective_bandwidth(self, direction=DOWNLOAD):
+        bandwidth = self.bandwidth[direction]
+        return bandwidth if bandwidth is not None else DEFAULT_BANDWIDTH
+
+    @property
+    def bdp(self):
+        """下行带宽时延积: 为跑满下行链路需要同时在途的字节数。"""
+        return self.effective_bandwidth(DOWNLOAD) * self.effective_rtt
+
+    @property
+    def window_size(self):
+        # 窗口至少为两倍 BDP，避免服务器因等待窗口更新而停顿 (仅影响下载)
+        return int(_clamp(2 * self.bdp, DEFAULT_WINDOW_SIZE, MAX_WINDOW_SIZE))
+
+    @property
+    def max_packet_size(self):
+        # 高 BDP 链路上使用更大的包以减少每包开销 (仅影响下载)
+        return DEFAULT_MAX_PACKET_SIZE * 2 if self.bdp > DEFAULT_WINDOW_SIZE else DEFAULT_MAX_PACKET_SIZE
+
+    def chunk_size(self, direction=DOWNLOAD):
+        # 每块约 0.25 秒的数据量，兼顾吞吐与进度刷新频率
+        bandwidth = self.effective_bandwidth(direction)
+        return _align(_clamp(bandwidth / 4, MIN_CHUNK_SIZE, MAX_CHUNK_SIZE), SFTP_REQUEST_SIZE)
+
+    @property
+    def max_requests(self):
+        # 下载预读时同时在途的 SFTP 请求数，需覆盖一个窗口
+        return int(_clamp(self.window_size // SFTP_REQUEST_SIZE, MIN_REQUESTS, MAX_REQUESTS))
+
+    def describe(self):
+        return (
+            f"RTT {self.effective_rtt * 1000:.0f} ms, "
+            f"下行 {format_rate(self.effective_bandwidth(DOWNLOAD))}, "
+            f"上行 {format_rate(self.effective_bandwidth(UPLOAD))}, "
+            f"窗口 {self.window_size // 1024} KB, 包 {self.max_packet_size // 1024} KB, "
+            f"下载块 {self.chunk_size(DOWNLOAD) // 1024} KB, 上传块 {self.chunk_size(UPLOAD) // 1024} KB, "
+            f"并发请求 {self.max_requests}"
+        )
+
+
+class TransferMeter:
+    """跟踪单次传输的进度，计算实时速率和剩余时间。"""
+
+    def __init__(self, total, window=2.0):
+        self.total = total
+        self.window = window
+        self.start = time.monotonic()
+        self.samples = [(self.start, 0)]
+
+    def update(self, done):
+        """记录已传输字节数，返回 (速率 字节/秒, 预计剩余秒数)。"""
+        now = time.monotonic()
+        self.samples.append((now, done))
+        # 只用最近 window 秒内的样本计算速率，让显示跟随链路变化
+        while len(self.samples) > 2 and now - self.samples[1][0] > self.window:
+            self.samples.pop(0)
+        first_time, first_done = self.samples[0]
+        elapsed = now - first_time
+        rate = (done - first_done) / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - done) / rate if rate > 0 else None
+        return rate, eta
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+
+def format_rate(rate):
+    """将字节/秒格式化为易读的速率字符串。"""
+    for unit in ("B/s", "KB/s", "MB/s"):
+        if rate < 1024:
+            return f"{rate:.1f} {unit}"
+        rate /= 1024
+    return f"{rate:.1f} GB/s"
+
+
+def format_eta(seconds):
+    """将剩余秒数格式化为 mm:ss 或 h:mm:ss。"""
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"